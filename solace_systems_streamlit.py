@@ -1,38 +1,127 @@
 import streamlit as st
 import folium
 from folium.plugins import TimestampedGeoJson
-from streamlit_folium import folium_static
-import pandas as pd
+from streamlit_folium import st_folium
 import numpy as np
 import datetime
-from shapely.geometry import Polygon
-import branca.colormap as cm
-from geopy.distance import geodesic
+import copy
+import math
+import orjson
+from numba import njit
 
-def app():
-    st.title("Fire Prevention System Demo")
-    st.subheader("Palisades Fire Simulation")
-    
-    # Palisades Village coordinates
-    palisades_village = [34.0453, -118.5265]
+# Polygon vertex angles (degrees) and their unit-circle components
+ANGLES = np.arange(0, 360, 10)
+COS_A = np.cos(np.radians(ANGLES))
+SIN_A = np.sin(np.radians(ANGLES))
+
+# Palisades Village coordinates
+palisades_village = [34.0453, -118.5265]
+
+# Simulated fire origin point
+fire_origin = [34.0556, -118.5334]
+
+# Fire spread parameters
+base_spread_rate = 0.2  # km/hour
+
+# -- Define a maximum spread radius (km)
+max_radius_km = 3.0
+
+def _haversine_km(a, b):
+    """Great-circle distance in km between two [lat, lon] points."""
+    R = 6371.0088  # mean Earth radius (km)
+    la1, lo1, la2, lo2 = map(math.radians, [a[0], a[1], b[0], b[1]])
+    dla = la2 - la1
+    dlo = lo2 - lo1
+    h = math.sin(dla / 2) ** 2 + math.cos(la1) * math.cos(la2) * math.sin(dlo / 2) ** 2
+    return 2 * R * math.asin(math.sqrt(h))
+
+class OrjsonTimestampedGeoJson(TimestampedGeoJson):
+    """TimestampedGeoJson that serializes its data with orjson instead of json."""
+
+    def __init__(self, data, **kwargs):
+        super().__init__(orjson.dumps(data).decode(), **kwargs)
+        # Still embedded GeoJSON, so bounds can be computed from it
+        self.embed = True
+
+@njit(cache=True, fastmath=True)
+def generate_polygons(days, hours_per_step, wind_direction, wind_speed, base_rate, max_r, n_zones, origin_lat, origin_lon):
+    """Compute the closed [lon, lat] rings of every zone at every timestep.
+
+    Returns ``out`` of shape (n_steps, n_zones, 37, 2), the number of
+    vertices of each ring (the ring is ``out[k, i, :n + 1]``), the elapsed
+    hours of each step, and for each step the index of the step whose
+    geometry it shares (itself unless the radius is capped and the wind
+    effect is unchanged, in which case ``out[k]`` is left unfilled).
+    The elapsed-hour-0 step is also left unfilled; it is drawn as a point.
+    """
+    n_angles = ANGLES.shape[0]
+    steps_per_day = (24 + hours_per_step - 1) // hours_per_step
+    n_steps = (days + 1) * steps_per_day
+    out = np.empty((n_steps, n_zones, n_angles + 1, 2))
+    n_vertices = np.empty((n_steps, n_zones), dtype=np.int64)
+    times = np.empty(n_steps, dtype=np.int64)
+    src = np.empty(n_steps, dtype=np.int64)
+    radii = np.empty(n_steps)
+    wind_effects = np.empty(n_steps)
     
-    # Simulated fire origin point
-    fire_origin = [34.0556, -118.5334]
+    wind_factor = wind_speed / 10
+    # km -> degrees conversion factors along each axis
+    deg_per_km_lon = 1.0 / (111.32 * math.cos(math.radians(origin_lat)))
+    deg_per_km_lat = 1.0 / 111.32
     
-    # Time control
-    st.sidebar.header("Simulation Controls")
-    days = st.sidebar.slider("Simulation Days", 1, 7, 3)
-    hours_per_step = st.sidebar.slider("Hours per Step", 1, 12, 6)
-    wind_direction = st.sidebar.slider("Wind Direction (degrees)", 0, 359, 225)
-    wind_speed = st.sidebar.slider("Wind Speed (mph)", 0, 30, 15)
+    # 1.0 for angles within 90 degrees of the wind direction, else 0.0
+    downwind = np.empty(n_angles)
+    for j in range(n_angles):
+        diff = abs(ANGLES[j] - wind_direction)
+        downwind[j] = 1.0 if diff < 90 or diff > 270 else 0.0
     
-    # Fire spread parameters
-    base_spread_rate = 0.2  # km/hour
-    wind_factor = wind_speed / 10
+    for k in range(n_steps):
+        day = k // steps_per_day
+        hour = (k % steps_per_day) * hours_per_step
+        elapsed_hours = day * 24 + hour
+        times[k] = elapsed_hours
+        if elapsed_hours == 0:
+            # Initial small fire
+            radius = 0.05  # km
+            wind_effect = 0.0
+        else:
+            radius = elapsed_hours * base_rate
+            wind_effect = wind_factor * elapsed_hours * 0.01
+        radii[k] = min(radius, max_r)
+        wind_effects[k] = wind_effect
+        
+        # Once the radius is capped the polygon only changes if the wind
+        # elongation does, so point back at the step that already has it
+        src[k] = k
+        if k > 0 and radii[k] >= max_r and radii[k - 1] >= max_r and wind_effect == wind_effects[k - 1]:
+            src[k] = src[k - 1]
     
-    # -- Define a maximum spread radius (km)
-    max_radius_km = 3.0
+    for k in range(n_steps):
+        # Shared steps are already filled, and the initial fire is drawn as
+        # a single point rather than as rings
+        if src[k] != k or times[k] == 0:
+            continue
+        for i in range(n_zones):
+            zone_r = radii[k] * (i + 1) / n_zones
+            # Small rings don't need the full angular resolution: every 10
+            # degrees when the wind-elongated extent is above 1 km, 20 above
+            # 0.1 km, 30 below that
+            r_eff = zone_r * (1.0 + wind_effects[k])
+            stride = 1 if r_eff > 1.0 else 2 if r_eff > 0.1 else 3
+            n = n_angles // stride
+            n_vertices[k, i] = n
+            for v in range(n):
+                j = v * stride
+                factor = 1.0 + wind_effects[k] * downwind[j]
+                out[k, i, v, 0] = origin_lon + zone_r * factor * COS_A[j] * deg_per_km_lon
+                out[k, i, v, 1] = origin_lat + zone_r * factor * SIN_A[j] * deg_per_km_lat
+            out[k, i, n] = out[k, i, 0]
     
+    return out, n_vertices, times, src
+
+@st.cache_resource
+def make_base_map() -> folium.Map:
+    """Build the map tiles, markers and protected zone, which no slider affects."""
     # Create base map
     center_lat = (fire_origin[0] + palisades_village[0]) / 2
     center_lon = (fire_origin[1] + palisades_village[1]) / 2
@@ -55,84 +144,108 @@ def app():
         icon=folium.Icon(icon="fire", prefix="fa", color="red")
     ).add_to(m)
     
-    # Fire polygons over time with layered danger zones
-    features = []
+    # Protected zone circle around Palisades Village
+    folium.Circle(
+        location=palisades_village,
+        radius=300,
+        color="blue",
+        fill=True,
+        fill_color="blue",
+        fill_opacity=0.1,
+        popup="Protected Zone"
+    ).add_to(m)
+    
+    return m
+
+@st.cache_resource(max_entries=32)
+def build_map(days, hours_per_step, wind_direction, wind_speed, n_zones=3) -> folium.Map:
+    """Build the fire simulation map for the given slider settings and zone count."""
+    # Slider-independent layers, copied so the cached base map stays clean
+    m = copy.deepcopy(make_base_map())
     
     # Start date (updated to 2025-01-07)
     start_time = datetime.datetime(2025, 1, 7, 0, 0)
     
-    # Number of zones and colors (from most dangerous to least)
-    n_zones = 3
-    zone_colors = ["red", "orange", "yellow"]
-    
-    for day in range(days + 1):
-        for hour in range(0, 24, hours_per_step):
-            if day == 0 and hour == 0:
-                # Initial small fire
-                radius = 0.05  # km
-                wind_effect = 0
-            else:
-                elapsed_hours = day * 24 + hour
-                radius = elapsed_hours * base_spread_rate
-                wind_effect = wind_factor * elapsed_hours * 0.01
-            
-            # -- Clamp the radius to max_radius_km
-            if radius > max_radius_km:
-                radius = max_radius_km
-            
-            # Create concentric zones (draw outer first so inner red appears on top)
-            for i in reversed(range(n_zones)):
-                fraction = (i + 1) / n_zones  # e.g., 1/3, 2/3, 3/3
-                zone_r = radius * fraction
-                color = zone_colors[i]
-                
-                points = []
-                for angle in range(0, 360, 10):
-                    angle_rad = np.radians(angle)
-                    factor = 1.0
-                    if abs(angle - wind_direction) < 90 or abs(angle - wind_direction) > 270:
-                        factor += wind_effect
-                    dx = zone_r * factor * np.cos(angle_rad)
-                    dy = zone_r * factor * np.sin(angle_rad)
-                    lon = fire_origin[1] + dx / 111.32 / np.cos(np.radians(fire_origin[0]))
-                    lat = fire_origin[0] + dy / 111.32
-                    points.append([lon, lat])
-                points.append(points[0])
-                
-                time = start_time + datetime.timedelta(days=day, hours=hour)
-                time_str = time.strftime("%Y-%m-%d %H:%M:%S")
-                
-                feature = {
-                    "type": "Feature",
-                    "geometry": {
-                        "type": "Polygon",
-                        "coordinates": [points]
-                    },
-                    "properties": {
-                        "time": time_str,
-                        "icon": "circle",
-                        "iconstyle": {
-                            "fillColor": color,
-                            "fillOpacity": 0.4,
-                            "stroke": True,
-                            "radius": 5,
-                            "weight": 1,
-                            "opacity": 0.8,
-                            "color": color
-                        },
-                        "style": {
-                            "color": color,
-                            "fillColor": color,
-                            "fillOpacity": 0.4,
-                            "weight": 1
-                        },
-                        "popup": f"Day {day}, Hour {hour} - Zone {i+1}"
-                    }
-                }
-                features.append(feature)
+    polygons, n_vertices, times, src = generate_polygons(
+        days, hours_per_step, wind_direction, wind_speed,
+        base_spread_rate, max_radius_km, n_zones, fire_origin[0], fire_origin[1]
+    )
+    
+    # All zones of a step share one MultiPolygon feature drawn in the outermost
+    # (least dangerous) zone's color; nonzero fill keeps the nested rings from
+    # striping. The icon settings style the initial fire point.
+    color = "yellow"
+    step_style = {
+        "icon": "circle",
+        "iconstyle": {
+            "fillColor": color,
+            "fillOpacity": 0.4,
+            "stroke": True,
+            "radius": 5,
+            "weight": 1,
+            "opacity": 0.8,
+            "color": color
+        },
+        "style": {
+            "color": color,
+            "fillColor": color,
+            "fillOpacity": 0.4,
+            "fillRule": "nonzero",
+            "weight": 1
+        }
+    }
+    
+    # (day, hour, geometry, time_str) for every step to emit
+    steps = [None] * len(times)
+    
+    # "YYYY-MM-DD HH:MM:SS" timestamp of each step; isoformat avoids strftime's
+    # format parsing and gives the same string for whole-second times
+    time_strs = [
+        (start_time + datetime.timedelta(hours=int(elapsed_hours))).isoformat(sep=" ")
+        for elapsed_hours in times
+    ]
+    
+    # Zone rings of the last computed step, shared by saturated duplicates
+    geometry = None
+    
+    for k in range(len(times)):
+        day, hour = divmod(int(times[k]), 24)
+        if times[k] == 0:
+            # The initial fire is sub-pixel at this zoom, so mark it with a
+            # single point instead of n_zones tiny rings
+            steps[k] = (day, hour, {
+                "type": "Point",
+                "coordinates": [fire_origin[1], fire_origin[0]]
+            }, time_strs[k])
+            continue
+        if src[k] == k:
+            # Concentric zones, outer first so inner rings are drawn on top
+            geometry = {
+                "type": "MultiPolygon",
+                "coordinates": [
+                    [polygons[k, i, :n_vertices[k, i] + 1].tolist()]
+                    for i in reversed(range(n_zones))
+                ]
+            }
+        
+        steps[k] = (day, hour, geometry, time_strs[k])
+    
+    # Fire polygons over time with layered danger zones
+    features = [
+        {
+            "type": "Feature",
+            "geometry": geometry,
+            "properties": {
+                **step_style,
+                "time": time_str,
+                "popup": f"Day {day}, Hour {hour}"
+            }
+        }
+        for day, hour, geometry, time_str in steps
+    ]
     
     # Time-stamped GeoJSON with looping enabled
-    timestamped_geojson = TimestampedGeoJson(
+    timestamped_geojson = OrjsonTimestampedGeoJson(
         {
             "type": "FeatureCollection",
             "features": features
@@ -149,18 +262,21 @@ def app():
     )
     timestamped_geojson.add_to(m)
     
-    # Protected zone circle around Palisades Village
-    folium.Circle(
-        location=palisades_village,
-        radius=300,
-        color="blue",
-        fill=True,
-        fill_color="blue",
-        fill_opacity=0.1,
-        popup="Protected Zone"
-    ).add_to(m)
+    return m
+
+def app(n_zones=3):
+    st.title("Fire Prevention System Demo")
+    st.subheader("Palisades Fire Simulation")
+    
+    # Time control
+    st.sidebar.header("Simulation Controls")
+    days = st.sidebar.slider("Simulation Days", 1, 7, 3)
+    hours_per_step = st.sidebar.slider("Hours per Step", 1, 12, 6)
+    wind_direction = st.sidebar.slider("Wind Direction (degrees)", 0, 359, 225)
+    wind_speed = st.sidebar.slider("Wind Speed (mph)", 0, 30, 15)
+    wind_factor = wind_speed / 10
     
-    distance = geodesic(fire_origin, palisades_village).kilometers
+    distance = _haversine_km(fire_origin, palisades_village)
     st.sidebar.subheader("Fire Information")
     st.sidebar.info(f"Distance from fire origin to Palisades Village: {distance:.2f} km")
     st.sidebar.info(
@@ -182,17 +298,20 @@ def app():
         "Pre-wet vegetation in approach path",
         "Set up early warning sensors in fire path"
     ]
-    for s in strategies:
-        st.sidebar.checkbox(s)
+    for i, s in enumerate(strategies):
+        st.sidebar.checkbox(s, key=f"strat_{i}")
     
     st.write("This simulation shows concentric danger zones with a capped spread. The fire stops growing once it reaches the maximum area, and then the simulation loops.")
-    folium_static(m)
+    # Rendering mutates a folium map, so render a copy and keep the map
+    # shared across sessions by the cache untouched
+    m = copy.deepcopy(build_map(days, hours_per_step, wind_direction, wind_speed, n_zones))
+    st_folium(m, width=900, height=600, returned_objects=[], key="fire_sim_map")
     
     with st.expander("How to use this demo"):
         st.write("""
         - Use the time slider or play button to watch the fire expand over time.
         - The fire expands until it reaches a maximum radius, then stops growing.
-        - Concentric zones indicate danger levels: red (highest), orange, yellow (lowest).
+        - Concentric rings indicate danger levels, from the innermost (highest) to the outermost (lowest).
         - When the timeline ends, the simulation repeats.
         """)
 